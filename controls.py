@@ -18,8 +18,9 @@ class GuiController:
 
         self.reset_button = GuiButton(name, self.set_deviation_value)
 
+        # Each widget has a single callback, on_num_change / on_slider_change ->
+        # set_deviation_value -> on_deviation_change_fn, exactly once per event
         self.num = gui.NumberEdit(gui.NumberEdit.DOUBLE)
-        self.num.set_on_value_changed(on_deviation_change_fn)
         self.num.set_value(self.default_value)
         self.num.set_on_value_changed(self.on_num_change)
 
@@ -37,7 +38,6 @@ class GuiController:
 
     def on_slider_change(self, slider_value):
         self.set_deviation_value(slider_value)
-        self.on_deviation_change_fn(slider_value)
 
     def on_num_change(self, num_value):
         # Limit the value to allowed range
@@ -45,4 +45,3 @@ class GuiController:
         num_value = min(num_value, self.limits[1])
 
         self.set_deviation_value(num_value)
-        self.on_deviation_change_fn(num_value)
@@ -6,6 +6,7 @@
 # ----------------------------------------------------------------------------
 
 import json
+import logging
 import numpy as np
 import open3d as o3d
 import open3d.visualization.gui as gui
@@ -13,11 +14,128 @@ import open3d.visualization.rendering as rendering
 import os
 import platform
 import sys
+import threading
 
 from controls import GuiButton
 
+try:
+    from numba import njit, types as nb_types
+    from numba.typed import Dict
+except ImportError:
+    njit = None
+
 isMacOS = (platform.system() == "Darwin")
 
+logger = logging.getLogger(__name__)
+
+# Golden ratio
+_PHI = (1 + np.sqrt(5)) / 2
+
+# Vertices of an icosahedron, all of them have the length sqrt(1 + PHI^2)
+_SEED_VERTICES = np.asarray([
+    (-1, _PHI, 0), (1, _PHI, 0), (-1, -_PHI, 0), (1, -_PHI, 0),
+    (0, -1, _PHI), (0, 1, _PHI), (0, -1, -_PHI), (0, 1, -_PHI),
+    (_PHI, 0, -1), (_PHI, 0, 1), (-_PHI, 0, -1), (-_PHI, 0, 1)
+], dtype=np.float64)
+# Stored as float32, plenty for a purely visual unit sphere at half the memory
+_SEED_VERTICES = (_SEED_VERTICES / np.sqrt(1.0 + _PHI * _PHI)).astype(np.float32)
+_SEED_VERTICES.setflags(write=False)
+
+# Faces of the icosahedron
+_SEED_FACES = np.asarray([
+    (0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11),
+    (1, 5, 9), (5, 11, 4), (11, 10, 2), (10, 7, 6), (7, 1, 8),
+    (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9),
+    (4, 9, 5), (2, 4, 11), (6, 2, 10), (8, 6, 7), (9, 8, 1)
+], dtype=np.int32)
+_SEED_FACES.setflags(write=False)
+
+
+def _pack_edges(edges):
+    # One int64 key (a << 32) | b per sorted edge, unique-ing these is much
+    # faster than np.unique(axis=0) on the (n, 2) rows
+    return (edges[:, 0].astype(np.int64) << 32) | edges[:, 1]
+
+
+def _unpack_edges(keys):
+    return np.stack([keys >> 32, keys & 0xFFFFFFFF], axis=1).astype(np.int32)
+
+
+def _subdivide_numpy(vertices, faces, index, levels):
+    # Subdivide triangles, one whole level at a time
+    for _ in range(levels):
+        # Every face contributes its three edges, sorted so that shared
+        # edges of neighbouring faces compare equal
+        edges = np.stack([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]], axis=1)
+        edges.sort(axis=-1)
+        keys, inv = np.unique(_pack_edges(edges.reshape(-1, 2)), return_inverse=True)
+        uniq = _unpack_edges(keys)
+
+        # One new vertex per unique edge, pushed out onto the unit sphere right
+        # away and appended after the existing ones
+        mid = (vertices[uniq[:, 0]] + vertices[uniq[:, 1]]) * 0.5
+        mid *= 1.0 / np.linalg.norm(mid, axis=1, keepdims=True)
+        vertices[index:index + len(uniq)] = mid
+        m = inv.reshape(-1, 3).astype(np.int32) + index
+        index += len(uniq)
+
+        # Split every triangle into four, written column by column straight
+        # into the new face array (v1, a, c), (v2, b, a), (v3, c, b), (a, b, c)
+        new_faces = np.empty((4 * len(faces), 3), dtype=np.int32)
+        for corner, (first, second) in enumerate(((0, 2), (1, 0), (2, 1))):
+            new_faces[corner::4, 0] = faces[:, corner]
+            new_faces[corner::4, 1] = m[:, first]
+            new_faces[corner::4, 2] = m[:, second]
+        new_faces[3::4] = m
+        faces = new_faces
+    return faces, index
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _midpoint(vertices, vertex_map, v1, v2, index):
+        # Both orders of an edge share one key, the lower index in the high half
+        if v1 < v2:
+            key = (np.int64(v1) << 32) | v2
+        else:
+            key = (np.int64(v2) << 32) | v1
+        if key in vertex_map:
+            return vertex_map[key], index
+        x = (vertices[v1, 0] + vertices[v2, 0]) * 0.5
+        y = (vertices[v1, 1] + vertices[v2, 1]) * 0.5
+        z = (vertices[v1, 2] + vertices[v2, 2]) * 0.5
+        scale = 1.0 / np.sqrt(x * x + y * y + z * z)
+        vertices[index, 0] = x * scale
+        vertices[index, 1] = y * scale
+        vertices[index, 2] = z * scale
+        vertex_map[key] = np.int32(index)
+        return np.int32(index), index + 1
+
+    @njit(cache=True)
+    def _subdivide_jit(vertices, faces, index, levels):
+        # Same result as _subdivide_numpy, in one pass over the faces per level
+        for _ in range(levels):
+            vertex_map = Dict.empty(key_type=nb_types.int64, value_type=nb_types.int32)
+            new_faces = np.empty((4 * faces.shape[0], 3), dtype=np.int32)
+            for f in range(faces.shape[0]):
+                v1, v2, v3 = faces[f, 0], faces[f, 1], faces[f, 2]
+                a, index = _midpoint(vertices, vertex_map, v1, v2, index)
+                b, index = _midpoint(vertices, vertex_map, v2, v3, index)
+                c, index = _midpoint(vertices, vertex_map, v3, v1, index)
+                new_faces[4 * f, 0], new_faces[4 * f, 1], new_faces[4 * f, 2] = v1, a, c
+                new_faces[4 * f + 1, 0], new_faces[4 * f + 1, 1], new_faces[4 * f + 1, 2] = v2, b, a
+                new_faces[4 * f + 2, 0], new_faces[4 * f + 2, 1], new_faces[4 * f + 2, 2] = v3, c, b
+                new_faces[4 * f + 3, 0], new_faces[4 * f + 3, 1], new_faces[4 * f + 3, 2] = a, b, c
+            faces = new_faces
+        return faces, index
+
+    _subdivide = _subdivide_jit
+    # Compile (or load from cache) now rather than on the first slider move
+    _subdivide(np.concatenate([_SEED_VERTICES, np.empty((30, 3), dtype=np.float32)]),
+               _SEED_FACES.copy(), len(_SEED_VERTICES), 1)
+else:
+    _subdivide = _subdivide_numpy
+
 
 class Settings:
     def __init__(self):
@@ -45,6 +163,13 @@ class AppWindow:
     MENU_SHOW_SETTINGS = 11
     MENU_ABOUT = 21
 
+    # Seconds the subdivisions slider has to rest before the full rebuild
+    SUBDIVISIONS_DEBOUNCE = 0.15
+    # Highest subdivision level shown directly while the slider is moving
+    SUBDIVISIONS_PREVIEW = 2
+    # Highest subdivision level the slider allows
+    SUBDIVISIONS_MAX = 6
+
     def __init__(self, width, height):
         self.settings = Settings()
 
@@ -70,7 +195,14 @@ class AppWindow:
         # ---- Menu ----
         self._prepare_menu()
 
-        # Create the Icosasphere
+        # Create the Icosasphere, keeping computed geometry per subdivision level
+        self._geom_cache = {}
+        self._current_subdivisions = None
+        self._redraw_pending = False
+        self._pending_subdiv = None
+        self._subdiv_timer = None
+        # float64 upload buffer sized for the highest level, reused by every rebuild
+        self._vbuf = np.empty((10 * 4 ** AppWindow.SUBDIVISIONS_MAX + 2, 3), dtype=np.float64)
         self._create_icosasphere()
 
         self._apply_settings()
@@ -133,7 +265,7 @@ class AppWindow:
 
         # Prepare the subdivisions slider for the icosphere
         self.subdivisions = gui.Slider(gui.Slider.INT)
-        self.subdivisions.set_limits(0, 6)
+        self.subdivisions.set_limits(0, AppWindow.SUBDIVISIONS_MAX)
         self.subdivisions.int_value = 0
         self.subdivisions.set_on_value_changed(self._on_subdivisions_change)
 
@@ -200,83 +332,76 @@ class AppWindow:
         self.window.set_on_menu_item_activated(AppWindow.MENU_ABOUT, self._on_menu_about)
 
     def _create_icosasphere(self, subdivisions=0):
+        # Nothing to upload again if this level is already in the scene
+        subdivisions = int(subdivisions)
+        if subdivisions == self._current_subdivisions:
+            return
+
         # Remove existing
-        print("Removing existing geometry")
+        logger.debug("Removing existing geometry")
         self._scene.scene.remove_geometry("Icosasphere")
 
-        # Golden ratio
-        PHI = (1 + np.sqrt(5)) / 2
+        # Subdivision levels already seen are reused instead of recomputed
+        geometry = self._geom_cache.get(subdivisions)
+        if geometry is None:
+            geometry = self._compute_icosasphere(subdivisions)
+            self._geom_cache[subdivisions] = geometry
+        vertices, lines = geometry
 
-        # Vertices of an icosahedron
-        vertices = [
-            (-1, PHI, 0), (1, PHI, 0), (-1, -PHI, 0), (1, -PHI, 0),
-            (0, -1, PHI), (0, 1, PHI), (0, -1, -PHI), (0, 1, -PHI),
-            (PHI, 0, -1), (PHI, 0, 1), (-PHI, 0, -1), (-PHI, 0, 1)
-        ]
-        vertices /= np.linalg.norm(vertices, axis=1)[:, np.newaxis]
-
-        # Faces of the icosahedron
-        faces = [
-            (0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11),
-            (1, 5, 9), (5, 11, 4), (11, 10, 2), (10, 7, 6), (7, 1, 8),
-            (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9),
-            (4, 9, 5), (2, 4, 11), (6, 2, 10), (8, 6, 7), (9, 8, 1)
-        ]
+        # Widen into the leading rows of the upload buffer, Vector3dVector copies
+        # it so the buffer is free again for the next rebuild
+        points = self._vbuf[:len(vertices)]
+        points[:] = vertices
 
-        print("Managing subdivisions")
-        # Subdivide triangles
-        for _ in range(subdivisions):
-            new_faces = []
-            vertex_map = {}
-            index = len(vertices)
-
-            def get_vertex(v1, v2):
-                nonlocal vertices, index
-                key = tuple(sorted([v1, v2]))
-                if key in vertex_map:
-                    return vertex_map[key]
-                else:
-                    new_vertex = (vertices[v1] + vertices[v2]) / 2
-                    vertices = np.vstack([vertices, new_vertex])  # Add new vertex
-                    vertex_map[key] = index
-                    index += 1
-                    return vertex_map[key]
-
-            for v1, v2, v3 in faces:
-                a = get_vertex(v1, v2)
-                b = get_vertex(v2, v3)
-                c = get_vertex(v3, v1)
-                new_faces.extend([
-                    (v1, a, c),
-                    (v2, b, a),
-                    (v3, c, b),
-                    (a, b, c)
-                ])
-            faces = new_faces
-
-        print("Creating line set")
-        # Create line set for visualization
-        lines = set()
-        for v1, v2, v3 in faces:
-            lines.update([(v1, v2), (v2, v3), (v3, v1)])
-
-        # Normalize vertices
-        vertices /= np.linalg.norm(vertices, axis=1)[:, np.newaxis]
-
-        print("Creating LineSet")
+        logger.debug("Creating LineSet")
         self.icosasphere = o3d.geometry.LineSet(
-            points=o3d.utility.Vector3dVector(vertices),
-            lines=o3d.utility.Vector2iVector(list(lines))
+            # Contiguous float64/int32 buffers take Open3D's memcpy fast path
+            points=o3d.utility.Vector3dVector(points),
+            lines=o3d.utility.Vector2iVector(np.ascontiguousarray(lines, dtype=np.int32))
         )
 
-        print("Adding geometry")
+        logger.debug("Adding geometry")
         self._scene.scene.add_geometry("Icosasphere", self.icosasphere,
                                        self.settings._camera_material)
-        print("Setting up camera")
+        logger.debug("Setting up camera")
         bounds = self._scene.scene.bounding_box
         self._scene.setup_camera(60, bounds, bounds.get_center())
+        self._request_redraw()
+        self._current_subdivisions = subdivisions
+
+    def _request_redraw(self):
+        # Redraw on the next main thread tick, rebuilds in between share that one redraw
+        if self._redraw_pending:
+            return
+        self._redraw_pending = True
+        gui.Application.instance.post_to_main_thread(self.window, self._on_redraw)
+
+    def _on_redraw(self):
+        self._redraw_pending = False
         self._scene.force_redraw()
 
+    @staticmethod
+    def _compute_icosasphere(subdivisions):
+        logger.debug("Managing subdivisions")
+        # The final vertex count is known up front (V = 10 * 4^k + 2), so the
+        # buffer is allocated once instead of growing it for every midpoint
+        vertices = np.empty((10 * 4 ** subdivisions + 2, 3), dtype=np.float32)
+        vertices[:len(_SEED_VERTICES)] = _SEED_VERTICES
+        index = len(_SEED_VERTICES)
+
+        faces = _SEED_FACES.copy()
+        faces, index = _subdivide(vertices, faces, index, subdivisions)
+        vertices = vertices[:index]
+
+        logger.debug("Creating line set")
+        # Create line set for visualization, each shared edge only once. The
+        # closed, consistently wound mesh walks every edge once in each
+        # direction, so keeping the ascending half-edges needs no deduplication
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]], axis=0)
+        lines = edges[edges[:, 0] < edges[:, 1]]
+
+        return vertices, lines
+
     def _apply_settings(self):
         bg_color = [
             self.settings.bg_color, self.settings.bg_color,
@@ -321,14 +446,47 @@ class AppWindow:
         self._apply_settings()
 
     def _on_reset_icosasphere(self):
-        print("Resetting")
+        logger.debug("Resetting")
+        self._cancel_pending_subdivisions()
         self.subdivisions.int_value = 0
         self._create_icosasphere()
 
     def _on_subdivisions_change(self, subdivisions):
-        print("Changing")
-        print("Subdivisions", int(subdivisions))
-        self._create_icosasphere(int(subdivisions))
+        subdivisions = int(subdivisions)
+        logger.debug("Changing subdivisions to %d", subdivisions)
+        self._cancel_pending_subdivisions()
+        if subdivisions <= AppWindow.SUBDIVISIONS_PREVIEW:
+            self._create_icosasphere(subdivisions)
+            return
+
+        # Show the cheap preview level while the slider is dragged and only build
+        # the requested level once no further change arrives for a short while
+        self._pending_subdiv = subdivisions
+        self._subdiv_timer = threading.Timer(AppWindow.SUBDIVISIONS_DEBOUNCE,
+                                             self._on_subdivisions_settled)
+        self._subdiv_timer.daemon = True
+        self._subdiv_timer.start()
+        self._create_icosasphere(AppWindow.SUBDIVISIONS_PREVIEW)
+
+    def _cancel_pending_subdivisions(self):
+        self._pending_subdiv = None
+        if self._subdiv_timer is not None:
+            self._subdiv_timer.cancel()
+            self._subdiv_timer = None
+
+    def _on_subdivisions_settled(self):
+        # The timer runs on its own thread, the scene may only be changed on the main thread
+        gui.Application.instance.post_to_main_thread(self.window,
+                                                     self._commit_pending_subdivisions)
+
+    def _commit_pending_subdivisions(self):
+        # A newer slider change or a reset may have superseded this request
+        if self._pending_subdiv is None:
+            return
+        subdivisions = self._pending_subdiv
+        self._pending_subdiv = None
+        self._subdiv_timer = None
+        self._create_icosasphere(subdivisions)
 
     def _on_menu_open(self):
         dlg = gui.FileDialog(gui.FileDialog.OPEN, "Choose file to load",